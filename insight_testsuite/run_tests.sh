@@ -10,6 +10,9 @@ GRADER_ROOT=$(dirname ${BASH_SOURCE})
 
 PROJECT_PATH=${GRADER_ROOT}/..
 
+# script that runs the code, relative to the project (default = run.sh)
+RUN_SCRIPT=${1:-run.sh}
+
 function print_dir_contents {
   local proj_path=$1
   echo "Project contents:"
@@ -29,7 +32,7 @@ function find_file_or_dir_in_project {
 
 # check project directory structure
 function check_project_struct {
-  find_file_or_dir_in_project ${PROJECT_PATH} run.sh
+  find_file_or_dir_in_project ${PROJECT_PATH} ${RUN_SCRIPT}
   find_file_or_dir_in_project ${PROJECT_PATH} src
   find_file_or_dir_in_project ${PROJECT_PATH} input
   find_file_or_dir_in_project ${PROJECT_PATH} output
@@ -45,7 +48,7 @@ function setup_testing_input_output {
   mkdir -p ${TEST_OUTPUT_PATH}
 
   cp -r ${PROJECT_PATH}/src ${TEST_OUTPUT_PATH}
-  cp -r ${PROJECT_PATH}/run.sh ${TEST_OUTPUT_PATH}
+  cp -r ${PROJECT_PATH}/${RUN_SCRIPT} ${TEST_OUTPUT_PATH}/run.sh
   cp -r ${PROJECT_PATH}/input ${TEST_OUTPUT_PATH}
   cp -r ${PROJECT_PATH}/output ${TEST_OUTPUT_PATH}
 
@@ -93,8 +96,8 @@ function run_all_tests {
     compare_outputs
   done
 
-  echo "[$(date)] ${PASS_CNT} of ${NUM_TESTS} tests passed"
-  echo "[$(date)] ${PASS_CNT} of ${NUM_TESTS} tests passed" >> ${GRADER_ROOT}/results.txt
+  echo "[$(date)] ${PASS_CNT} of ${NUM_TESTS} tests passed (${RUN_SCRIPT})"
+  echo "[$(date)] ${PASS_CNT} of ${NUM_TESTS} tests passed (${RUN_SCRIPT})" >> ${GRADER_ROOT}/results.txt
 }
 
 check_project_struct
@@ -0,0 +1,10 @@
+#!/bin/bash
+#
+# Same as run.sh, but parses the whole log at once with SessionParser.parse_bulk
+# (requires pandas). Run the tests with it from the insight_testsuite folder with
+# `./run_tests.sh run_bulk.sh`.
+#
+
+rm -f ./output/sessionization.txt
+
+python ./src/sessionization.py -b ./input/log.csv ./input/inactivity_period.txt ./output/sessionization.txt
@@ -0,0 +1,11 @@
+#!/bin/bash
+#
+# Same as run.sh, but parses the log in parallel with src/sessionization_mp.py. A
+# fixed number of worker processes is used, so the requests are always split into
+# several shards. Run the tests with it from the insight_testsuite folder with
+# `./run_tests.sh run_parallel.sh`.
+#
+
+rm -f ./output/sessionization.txt
+
+python ./src/sessionization_mp.py -j 4 ./input/log.csv ./input/inactivity_period.txt ./output/sessionization.txt
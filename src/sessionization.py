@@ -1,7 +1,31 @@
 import sys, argparse
 import warnings
-from datetime import datetime, timedelta
-from itertools import islice
+import calendar, time
+import csv, mmap, re
+from collections import OrderedDict
+from datetime import datetime
+from operator import attrgetter
+
+# maximum number of parsed timestamps kept by a SessionParser
+DT_CACHE_SIZE = 65536
+
+# buffer size in bytes for the log and output files
+BUFFER_SIZE = 1 << 20
+
+# valid (anonymized) ip address: four '.' separated parts of 1-3 characters
+IP_PATTERN = re.compile(r'[^.]{1,3}(\.[^.]{1,3}){3}\Z')
+
+def _parse_time(date,hms):
+    """Return integer seconds since the epoch (UTC) for `date` and `hms` strings
+    in the fixed '%Y-%m-%d' and '%H:%M:%S' formats, or None if they are invalid.
+    """
+    try:
+        return calendar.timegm(datetime(
+                    int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                    int(hms[0:2]), int(hms[3:5]), int(hms[6:8])
+                    ).timetuple())
+    except ValueError:
+        return None
 
 class SessionParser(object):
     """Parser for SEC EDGAR log data in csv format
@@ -19,21 +43,30 @@ class SessionParser(object):
                                 a session is terminated (default = 2).
     :param fields: Dictionary with integer csv column number referenced by
                     field string. (default = {'ip':0, 'date':1, 'time':2}).
+    :param validate_ip: If True, skip requests with an invalid ip address
+                    (default = True).
     """
-    def __init__(self,output,inactivity_period=2,fields=None):
+    def __init__(self,output,inactivity_period=2,fields=None,validate_ip=True):
 
-        # store active users in dictionary with ip address as the key
-        self.active_users = {}
+        # store active users in dictionary with ip address as the key, ordered
+        # by the time of their latest request (oldest first)
+        self.active_users = OrderedDict()
 
-        # store the current time as a datetime object
+        # store the current time as integer seconds since the epoch
         self.current_time = None
 
         # give each parsed line a unique ID to avoid any order output ambiguity.
         self.line_id = 0
 
+        # cache of parsed timestamps, keyed by the date and time strings. Many
+        # requests share the same second, so most lines are a cache hit.
+        self._dt_cache = {}
+
         # file object to write output to
         self.output = output
 
+        self.validate_ip = validate_ip
+
         try:
             self.inactivity_period = int(inactivity_period)
         except:
@@ -63,6 +96,10 @@ class SessionParser(object):
                     self.__fields_error()
             except:
                 self.__fields_error()
+            self.fields = fields
+
+        # number of leading fields needed to reach the last required field
+        self._num_fields = 1 + max([ self.fields[x] for x in ['ip','date','time'] ])
 
 
     def __fields_error(self):
@@ -82,62 +119,128 @@ class SessionParser(object):
             >>> sp.parse_requests(input)
             >>> sp.terminate_remaining_sessions()
 
-        :param requests: File object or generator with csv log data
+        :param requests: File object or generator with csv log data. Lines may
+                         also be ASCII `bytes`, with a `bytes` delimeter
+                         (e.g. from a file opened in binary mode).
         :param delimeter: Delimeter separating fields in requests (default = ',')
         """
 
-        for line in requests:
+        # with bytes lines, ip addresses are decoded for new users only
+        decode_ip = isinstance(delimeter,bytes) and not isinstance(delimeter,str)
+
+        # look up values that are fixed while parsing once, outside of the loop
+        ip_i = self.fields['ip']
+        date_i = self.fields['date']
+        time_i = self.fields['time']
+        num_fields = self._num_fields
+        dt_cache = self._dt_cache
+        inactivity_period = self.inactivity_period
+        validate_ip = self.validate_ip
+        active_users = self.active_users
+
+        # parser state is kept in locals while parsing, `current_time` is also
+        # stored whenever it changes since it's used to terminate sessions
+        line_id = self.line_id
+        current_time = self.current_time
+
+        # the user of the previous request is already at the back of the expiry
+        # order, so repeated requests from one ip need no lookup or reordering
+        last_ip = None
+        last_user = None
 
-            try:
+        try:
+            for line in requests:
 
-                # split the line into arguments
-                args = line.split(delimeter)
+                # unique line id for the request
+                lid = line_id
+                line_id += 1
 
-                # pick out the arguments that are needed
-                uip = args[ self.fields['ip'] ]
-                date = args[ self.fields['date'] ]
-                time = args[ self.fields['time'] ]
+                # split off the needed arguments, leaving the trailing fields
+                # joined so that the last needed field is separated exactly
+                args = line.split(delimeter,num_fields)
+                if len(args) < num_fields:
+                    self._skip_line(lid)
+                    continue
 
-                dtime = datetime.strptime(date + ' ' + time,
-                                            '%Y-%m-%d %H:%M:%S')
+                # pick out the arguments that are needed
+                uip = args[ip_i]
+                date = args[date_i]
+                hms = args[time_i]
+
+                # convert to epoch seconds, reusing previously parsed timestamps
+                stamp = date + delimeter + hms
+                dtime = dt_cache.get(stamp)
+                if dtime is None:
+                    dtime = _parse_time(date,hms)
+                    if dtime is None:
+                        self._skip_line(lid)
+                        continue
+
+                    # bound the cache size
+                    if len(dt_cache) >= DT_CACHE_SIZE:
+                        dt_cache.clear()
+                    dt_cache[stamp] = dtime
 
                 # Check and store time
-                if self.current_time is None:
-                    self.current_time = dtime
-                    delta = timedelta(seconds=0)
-                else:
-                    delta = dtime - self.current_time
-                    self.current_time = dtime
-
-                # if the time has changed check for terminated sessions
-                if delta.seconds > 0:
-                    self._detect_terminated_sessions()
+                if dtime != current_time:
+
+                    # requests must be in chronological order
+                    if current_time is not None and dtime < current_time:
+                        self._skip_line(lid)
+                        continue
+                    current_time = self.current_time = dtime
+
+                    # the time has changed, check for terminated sessions if
+                    # the session of the oldest active user has expired
+                    if active_users:
+                        oldest = active_users[next(iter(active_users))]
+                        if dtime - oldest.latest_time > inactivity_period:
+                            self._detect_terminated_sessions()
+                            last_ip = None
+
+                # same user as the previous request
+                if uip == last_ip:
+                    last_user.update(current_time)
+                    continue
 
                 # Check if user is active, and store or update as necessary
-                if uip in self.active_users.keys():
-                    u = self.active_users[uip]
-                    u.update(self.current_time)
+                u = active_users.get(uip)
+                if u is None:
+                    try:
+                        u = User(lid,uip.decode('utf-8') if decode_ip else uip,
+                                 current_time,validate_ip)
+                    except ValueError:
+                        self._skip_line(lid)
+                        continue
+                    active_users[uip] = u
                 else:
-                    u = User(self.line_id,uip,self.current_time)
-                    self.active_users.update({uip:u})
+                    u.update(current_time)
 
-            except:
-                # On failure, skip line and print warning
-                warnings.warn('Skipping line '+str(self.line_id)+': failed to parse.',
-                            RuntimeWarning)
+                    # move the user to the back of the expiry order
+                    active_users[uip] = active_users.pop(uip)
+
+                last_ip = uip
+                last_user = u
 
-            # increment unique line id
-            self.line_id += 1
+        finally:
+            self.line_id = line_id
+
+    def _skip_line(self,lid):
+        """Print a warning that the line with id `lid` is skipped"""
+
+        warnings.warn('Skipping line '+str(lid)+': failed to parse.',
+                      RuntimeWarning)
 
     def _write_session_info(self,sessions):
         """Print session information for list of Users to `output`"""
 
-        # sort so that sessions print in the correct order
-        sessions.sort(key=lambda x: (x.start_time,x.lid))
+        # sort so that sessions print in the correct order, by start time and
+        # line id. Requests are kept in chronological order, so start times
+        # never decrease with line id and sorting by line id alone suffices.
+        sessions.sort(key=attrgetter('lid'))
 
-        # write to output file
-        for user in sessions:
-            self.output.write( user.session_info())
+        # write to output file in a single call
+        self.output.write(''.join([ user.session_info() for user in sessions ]))
 
     def _detect_terminated_sessions(self):
         """Remove users with session length exceeding `inactivity_period` and
@@ -146,19 +249,22 @@ class SessionParser(object):
 
         terminated_sessions = []
 
-        # iterate through active users
-        for uip in self.active_users.keys():
-
-            user = self.active_users[uip]
-
-            # Check if user's session has expired
-            if (self.current_time - user.latest_time).seconds > self.inactivity_period:
+        # sessions with a latest request before the cutoff have expired
+        cutoff = self.current_time - self.inactivity_period
+        active_users = self.active_users
 
-                # store users with terminated session
-                terminated_sessions.append(user)
+        # users are ordered by latest request, so the expired users are the
+        # ones at the front of `active_users`, up to the first active user
+        for uip in active_users:
+            user = active_users[uip]
+            if user.latest_time >= cutoff:
+                break
+            terminated_sessions.append(user)
 
-                # remove user from active users
-                self.active_users.pop(uip)
+        # remove the terminated users from active users
+        popitem = active_users.popitem
+        for user in terminated_sessions:
+            popitem(last=False)
 
         self._write_session_info(terminated_sessions)
 
@@ -166,21 +272,163 @@ class SessionParser(object):
         """Remove all users and output their session info."""
 
         # store users with terminated session
-        terminated_sessions = [ self.active_users[ip] for ip in self.active_users.keys()]
+        terminated_sessions = list(self.active_users.values())
 
         # reset active users
-        self.active_users = {}
+        self.active_users = OrderedDict()
 
         self._write_session_info(terminated_sessions)
 
+    def parse_bulk(self,requests,delimeter=',',header=0):
+        """Parse a complete SEC EDGAR log at once, using pandas
+
+        Sessions are computed for the whole log with vectorized operations,
+        and written to `output` in the same order as by `parse_requests`
+        followed by `terminate_remaining_sessions`. This is intended for
+        offline processing of large logs, and requires the optional `pandas`
+        and `numpy` dependencies.
+
+        Usage::
+
+            >>> from sessionization import SessionParser
+            >>> ouput = open('output.txt','w')
+            >>> sp = SessionParser(output)
+            >>> sp.parse_bulk('log.csv',header=1)
+
+        :param requests: File path or file object with csv log data
+        :param delimeter: Delimeter separating fields in requests (default = ',')
+        :param header: Number of header lines to skip (default = 0)
+        """
+
+        try:
+            import numpy as np
+            import pandas as pd
+        except ImportError:
+            raise ImportError('`parse_bulk` requires pandas and numpy.')
+
+        if self.active_users:
+            raise ValueError('`parse_bulk` requires a parser without active sessions.')
+
+        # name the leading columns explicitly, rather than counting them in the
+        # first line, so that lines missing fields read as empty fields
+        cols = [ self.fields[x] for x in ['ip','date','time'] ]
+        def read_csv(**kwargs):
+            return pd.read_csv(requests, sep=delimeter, header=None, skiprows=header,
+                               names=list(range(self._num_fields)), dtype=str,
+                               quoting=csv.QUOTE_NONE, skip_blank_lines=False,
+                               na_filter=False, **kwargs)
+
+        start = requests.tell() if hasattr(requests,'tell') else None
+        try:
+            df = read_csv(usecols=cols)
+        except pd.errors.EmptyDataError:
+            return
+        except pd.errors.ParserError:
+            # no line has all the needed fields, so `usecols` can't be matched.
+            # Every line has fewer fields than named, so read them all instead.
+            if start is not None:
+                requests.seek(start)
+            df = read_csv()
+        n = len(df)
+        lids = self.line_id + np.arange(n)
+
+        # work with integer codes for the (highly repetitive) string columns
+        ip_codes, ip_names = pd.factorize(df[cols[0]])
+        date_codes, dates = pd.factorize(df[cols[1]])
+        time_codes, times = pd.factorize(df[cols[2]])
+
+        # parse each distinct date and time once, lines that fail are skipped
+        dates = pd.to_datetime(pd.Series(dates), format='%Y-%m-%d', errors='coerce')
+        times = pd.to_datetime(pd.Series(times), format='%H:%M:%S', errors='coerce')
+        valid = dates.notna().to_numpy()[date_codes] & \
+                times.notna().to_numpy()[time_codes]
+        dates = dates.to_numpy().astype('datetime64[s]').astype(np.int64)
+        times = (times - pd.Timestamp(1900,1,1)).to_numpy().astype('timedelta64[s]')
+        times = dates[date_codes] + times.astype(np.int64)[time_codes]
+
+        # requests preceding the time of an earlier request are skipped
+        idx = np.flatnonzero(valid)
+        if len(idx) > 0:
+            clock = np.maximum.accumulate(times[idx])
+            prev = np.empty_like(clock)
+            prev[0] = clock[0] if self.current_time is None \
+                        else max(clock[0],self.current_time)
+            prev[1:] = np.maximum(clock[:-1],prev[0])
+            valid[idx[times[idx] < prev]] = False
+
+        # every remaining line advances the clock
+        ticks = np.unique(times[valid])
+
+        # lines with an invalid ip do not belong to a session
+        ip_names = np.asarray(ip_names, dtype=object)
+        if self.validate_ip:
+            ip_ok = pd.Series(ip_names).str.match(IP_PATTERN)
+            valid &= ip_ok.to_numpy(dtype=bool)[ip_codes]
+
+        num_skipped = n - int(valid.sum())
+        if num_skipped > 0:
+            warnings.warn('Skipping '+str(num_skipped)+' lines: failed to parse.',
+                        RuntimeWarning)
+
+        self.line_id += n
+        if len(ticks) == 0:
+            return
+        self.current_time = int(ticks[-1])
+
+        # the clock advanced, but no request belongs to a session
+        if not valid.any():
+            return
+
+        # group requests by ip (keeping line order), and start a new session
+        # whenever the gap between requests exceeds the inactivity period
+        ip_codes, lids, times = ip_codes[valid], lids[valid], times[valid]
+        order = np.argsort(ip_codes, kind='stable')
+        ip_codes, lids, times = ip_codes[order], lids[order], times[order]
+        new = np.ones(len(ip_codes), dtype=bool)
+        new[1:] = (ip_codes[1:] != ip_codes[:-1]) | \
+                  (times[1:] - times[:-1] > self.inactivity_period)
+
+        starts = np.flatnonzero(new)
+        ends = np.append(starts[1:], len(ip_codes)) - 1
+        start_times, end_times = times[starts], times[ends]
+
+        # a session is output at the first change of time beyond its
+        # inactivity period, or at the end of the log
+        i = np.searchsorted(ticks, end_times + self.inactivity_period, side='right')
+        emit = np.where(i < len(ticks), ticks[np.minimum(i,len(ticks)-1)],
+                        np.iinfo(np.int64).max)
+        order = np.lexsort((lids[starts], start_times, emit))
+        starts, ends = starts[order], ends[order]
+        start_times, end_times = start_times[order], end_times[order]
+
+        # format each distinct time once
+        stamps, inverse = np.unique(np.append(start_times, end_times),
+                                    return_inverse=True)
+        stamps = pd.to_datetime(stamps, unit='s').strftime('%Y-%m-%d %H:%M:%S')
+        stamps = np.asarray(stamps, dtype=object)[inverse]
+
+        sessions = pd.DataFrame({ 'ip':ip_names[ip_codes[starts]],
+                                  'start':stamps[:len(starts)],
+                                  'end':stamps[len(starts):],
+                                  'length':end_times - start_times + 1,
+                                  'num_docs':ends - starts + 1 })
+        sessions.to_csv(self.output, header=False, index=False,
+                        quoting=csv.QUOTE_NONE, lineterminator='\n')
+
 class User(object):
     """Represents a user in a SEC EDGAR data log and tracks requests
 
     :param lid: integer line number for user's first request in a session
     :param ip: user ip address string
-    :param start_time: datetime object for time of user's first request in a session
+    :param start_time: integer seconds since the epoch (UTC) for time of user's
+                        first request in a session
+    :param validate: If True, check that `ip` is a valid ip address
     """
-    def __init__(self,lid,ip,start_time):
+
+    # avoid a per-instance __dict__, there can be many active users
+    __slots__ = ('lid','ip','start_time','latest_time','num_docs')
+
+    def __init__(self,lid,ip,start_time,validate=True):
 
         # identifying information
         self.lid = lid
@@ -193,19 +441,16 @@ class User(object):
         self.num_docs = 1
 
         # check for valid ip
-        try:
-            ip_arr = self.ip.split('.')
-            if len(ip_arr) != 4:
-                self.__ip_error()
-            for x in ip_arr:
-                if (len(x) < 1) or (len(x) > 3):
+        if validate:
+            try:
+                if not IP_PATTERN.match(self.ip):
                     self.__ip_error()
-        except:
-            self.__ip_error()
+            except:
+                self.__ip_error()
 
         # check for valid start time
-        if not isinstance(start_time,datetime):
-            raise ValueError('start_time must be a valid datetime object.')
+        if not isinstance(start_time,int):
+            raise ValueError('start_time must be an integer number of seconds.')
 
         if not isinstance(lid,int):
             raise ValueError('lid must be an integer.')
@@ -218,13 +463,14 @@ class User(object):
 
         Usage:
             >>> import sessionization
-            >>> from datetime import datetime
+            >>> import calendar, time
             >>> fmt = '%Y-%m-%d %H:%M:%S'
             >>> u = sessionization.User(0,'107.23.85.jfd',
-            >>>         datetime.strptime( '2017-06-30 00:00:04', fmt)
-            >>> u.update(datetime.strptime( '2017-06-30 00:00:06', fmt)
+            >>>         calendar.timegm(time.strptime('2017-06-30 00:00:04', fmt)))
+            >>> u.update(calendar.timegm(time.strptime('2017-06-30 00:00:06', fmt)))
 
-        :param time: datetime object for time of user's new request
+        :param time: integer seconds since the epoch (UTC) for time of user's new
+                        request
         """
 
         # check that time is after start time
@@ -241,18 +487,62 @@ class User(object):
     def session_length(self):
         '''Return the users session length in seconds as an integer'''
 
-        return 1 + (self.latest_time - self.start_time).seconds
+        return 1 + self.latest_time - self.start_time
 
     def session_info(self,fmt='%Y-%m-%d %H:%M:%S'):
         '''Return a string representation of the session in csv format:
 
             >>> ip,start_datetime,end_datetime,session_length,num_docs
 
-        :param fmt: output format for datetime objects
+        :param fmt: output format for times
         '''
-        return self.ip + ',' + self.start_time.strftime(fmt) + ',' + \
-               self.latest_time.strftime(fmt) + ',' + \
-               str(self.session_length()) + ',' + str(self.num_docs) + '\n'
+        return ','.join(( self.ip,
+                          time.strftime(fmt,time.gmtime(self.start_time)),
+                          time.strftime(fmt,time.gmtime(self.latest_time)),
+                          str(self.session_length()),
+                          str(self.num_docs) )) + '\n'
+
+
+def read_lines(f):
+    """Return an iterator over the remaining lines of binary file object `f`,
+    read through a memory map of the file when possible.
+    """
+
+    try:
+        mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    except (ValueError,EnvironmentError):
+        # e.g. empty files and pipes can't be memory mapped
+        return f
+
+    mm.seek(f.tell())
+    return _read_mapped_lines(mm)
+
+def _read_mapped_lines(mm):
+    """Generate the remaining lines of memory map `mm`, and close it when done"""
+
+    try:
+        for line in iter(mm.readline,b''):
+            yield line
+    finally:
+        mm.close()
+
+def read_inactivity_period(f):
+    """Return the integer inactivity period stored in the first line of file
+    object `f`.
+    """
+
+    inactivity_content = [x.rstrip() for x in f.readlines()]
+
+    try:
+        inactivity_period = int(inactivity_content[0])
+    except:
+        raise ValueError('inactivity_period must be an integer number of seconds.')
+
+    if len(inactivity_content) > 1:
+        warnings.warn("Only the the first line of file considered for inactivity period.",
+                      SyntaxWarning)
+
+    return inactivity_period
 
 
 if __name__ == "__main__":
@@ -262,38 +552,25 @@ if __name__ == "__main__":
                                      'Parse SEC EDGAR log into Sessions.')
 
     parser.add_argument('log_file', metavar='log*.csv',
-                        type=argparse.FileType('r'),
+                        type=argparse.FileType('rb',BUFFER_SIZE),
                         help='EDGAR weblog data file (csv)')
     parser.add_argument('inactivity_period', metavar='inactivity_period',
                         type=argparse.FileType('r'),
                         help='text file storing integer inactivity period')
     parser.add_argument('output_file', metavar='output',
-                        type=argparse.FileType('a'),
+                        type=argparse.FileType('a',BUFFER_SIZE),
                         help='output text file with session information',
                         default=sys.stdout)
-    parser.add_argument("-n", "--line_buffer", type=int,
-                    help="number of lines to parse at a time",default=100 )
     parser.add_argument("-d", "--header", type=int,
                     help="number of header lines to skip at start of log file",default=1 )
+    parser.add_argument("-b", "--bulk", action="store_true",
+                    help="parse the whole log file at once (requires pandas)" )
 
     args = parser.parse_args()
 
-    if args.line_buffer < 0:
-        raise ValueError("line_buffer ('-n') must be a positive integer")
-
     # Store inactivity period
     with args.inactivity_period as f:
-
-       inactivity_content = [x.rstrip() for x in f.readlines()]
-
-       try:
-           inactivity_period = int(inactivity_content[0])
-       except:
-            raise ValueError('inactivity_period must be an integer number of seconds.')
-
-       if len(inactivity_content) > 1:
-           warnings.warn("Only the the first line of file considered for inactivity period.",
-                         SyntaxWarning)
+        inactivity_period = read_inactivity_period(f)
 
     # initialize instance of parser
     sp = SessionParser(args.output_file,inactivity_period=inactivity_period)
@@ -304,12 +581,11 @@ if __name__ == "__main__":
         for i in range(args.header):
             line = f.readline()
 
-        # pass the selected number of line from the log to be parsed
-        while True:
-            line_gen = list(islice(f, args.line_buffer))
-            if not line_gen:
-                break
-            sp.parse_requests(line_gen)
+        # stream the rest of the log to the parser, or parse it all at once
+        if args.bulk:
+            sp.parse_bulk(f)
+        else:
+            sp.parse_requests(read_lines(f),delimeter=b',')
 
         # clean up at end of file, handle all remaining actbe sessions
         sp.terminate_remaining_sessions()
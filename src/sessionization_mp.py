@@ -0,0 +1,436 @@
+import sys, argparse
+import heapq, os, shutil, tempfile, warnings
+from array import array
+from bisect import bisect_right
+from multiprocessing import Process, Queue, cpu_count
+
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
+
+from sessionization import SessionParser, User, BUFFER_SIZE, DT_CACHE_SIZE, \
+                           _parse_time, read_lines, read_inactivity_period
+
+# number of requests sent to a worker at a time
+BATCH_SIZE = 1 << 14
+
+# maximum number of batches waiting to be parsed by each worker
+QUEUE_SIZE = 16
+
+class RequestDispatcher(object):
+    """Reader for SEC EDGAR log data in csv format, which splits the requests
+    into shards for parallel parsing.
+
+    Each line is split once. Lines that can't be parsed and requests earlier
+    than the current time are skipped, as by `SessionParser`, so the clock is
+    kept over the whole log. The remaining requests are assigned to
+    `num_shards` shards by a hash of their ip address, and passed to
+    `send(shard,batch)` in batches of::
+
+        >>> (line_ids, times, ips)
+
+    where `line_ids` and `times` are arrays of the line ids and integer epoch
+    seconds of the requests, and `ips` the ip addresses of the requests joined
+    by the delimeter. The times at which the clock changes are stored in
+    `ticks`, which orders the sessions of all shards with `sort_shard_sessions`
+    and `merge_shard_sessions`.
+
+    Usage::
+
+        >>> from sessionization_mp import RequestDispatcher
+        >>> input = open('log.csv','rb')
+        >>> rd = RequestDispatcher(4,send)
+        >>> rd.dispatch(input)
+
+    :param num_shards: Integer number of shards
+    :param send: Function called with the shard number and each batch
+    :param fields: Dictionary with integer csv column number referenced by
+                    field string. (default = {'ip':0, 'date':1, 'time':2}).
+    """
+    def __init__(self,num_shards,send,fields=None):
+
+        self.num_shards = num_shards
+        self.send = send
+
+        if fields is None:
+            fields = { 'ip':0, 'date':1, 'time':2 }
+        self.fields = fields
+        self._num_fields = 1 + max([ fields[x] for x in ['ip','date','time'] ])
+
+        # store the current time as integer seconds since the epoch
+        self.current_time = None
+
+        # unique ID of the next line, counted over all lines of the log
+        self.line_id = 0
+
+        # cache of parsed timestamps, as in `SessionParser`
+        self._dt_cache = {}
+
+        # record each time the clock changes
+        self.ticks = array('l')
+
+    def dispatch(self,requests,delimeter=b','):
+        """Split SEC EDGAR log data in csv format into shards, and send them
+
+        :param requests: File object or generator with csv log data, as `bytes`
+                         lines with a `bytes` delimeter or as text lines with a
+                         text delimeter.
+        :param delimeter: Delimeter separating fields in requests (default = b',')
+        """
+
+        # look up values that are fixed while parsing once, outside of the loop
+        ip_i = self.fields['ip']
+        date_i = self.fields['date']
+        time_i = self.fields['time']
+        num_fields = self._num_fields
+        dt_cache = self._dt_cache
+        num_shards = self.num_shards
+        send = self.send
+        ticks = self.ticks
+
+        line_id = self.line_id
+        current_time = self.current_time
+
+        # requests of each shard waiting to be sent
+        shard_lids = [ array('l') for i in range(num_shards) ]
+        shard_times = [ array('l') for i in range(num_shards) ]
+        shard_ips = [ [] for i in range(num_shards) ]
+
+        # consecutive requests are often from the same ip address
+        last_ip = None
+        shard = None
+
+        try:
+            for line in requests:
+
+                # unique line id for the request
+                lid = line_id
+                line_id += 1
+
+                # split off the needed arguments
+                args = line.split(delimeter,num_fields)
+                if len(args) < num_fields:
+                    self._skip_line(lid)
+                    continue
+
+                uip = args[ip_i]
+                date = args[date_i]
+                hms = args[time_i]
+
+                # convert to epoch seconds, reusing previously parsed timestamps
+                stamp = date + delimeter + hms
+                dtime = dt_cache.get(stamp)
+                if dtime is None:
+                    dtime = _parse_time(date,hms)
+                    if dtime is None:
+                        self._skip_line(lid)
+                        continue
+
+                    # bound the cache size
+                    if len(dt_cache) >= DT_CACHE_SIZE:
+                        dt_cache.clear()
+                    dt_cache[stamp] = dtime
+
+                # Check and store time
+                if dtime != current_time:
+
+                    # requests must be in chronological order
+                    if current_time is not None and dtime < current_time:
+                        self._skip_line(lid)
+                        continue
+                    current_time = dtime
+                    ticks.append(dtime)
+
+                # shards only need to agree within this process, so hash() will do
+                if uip != last_ip:
+                    last_ip = uip
+                    shard = hash(uip) % num_shards
+
+                ips = shard_ips[shard]
+                ips.append(uip)
+                shard_lids[shard].append(lid)
+                shard_times[shard].append(dtime)
+
+                if len(ips) >= BATCH_SIZE:
+                    send(shard,(shard_lids[shard],shard_times[shard],
+                                delimeter.join(ips)))
+                    shard_lids[shard] = array('l')
+                    shard_times[shard] = array('l')
+                    shard_ips[shard] = []
+
+        finally:
+            self.line_id = line_id
+            self.current_time = current_time
+
+        # send the rest of the requests
+        for shard in range(num_shards):
+            if shard_ips[shard]:
+                send(shard,(shard_lids[shard],shard_times[shard],
+                            delimeter.join(shard_ips[shard])))
+
+    def _skip_line(self,lid):
+        """Print a warning that the line with id `lid` is skipped"""
+
+        warnings.warn('Skipping line '+str(lid)+': failed to parse.',
+                      RuntimeWarning)
+
+class ShardSessionParser(SessionParser):
+    """Parser for the requests of one shard of ip addresses in a SEC EDGAR log
+
+    Sessions only depend on the requests of their own ip address, so the
+    shards split by a `RequestDispatcher` can be parsed independently. Instead
+    of session info in the output order, the terminated sessions are written
+    to `output` as::
+
+        >>> line_id,end_time,ip,start_datetime,end_datetime,session_length,num_docs
+
+    where `line_id` is the id of the first request in the session counted
+    over all lines of the log.
+
+    Usage::
+
+        >>> from sessionization_mp import ShardSessionParser
+        >>> ouput = open('shard0.txt','w')
+        >>> sp = ShardSessionParser(ouput)
+        >>> sp.parse_batch(line_ids,times,ips)
+        >>> sp.terminate_remaining_sessions()
+
+    :param output: File object to write terminated sessions to
+    :param kwargs: Keyword arguments passed on to `SessionParser`
+    """
+
+    def parse_batch(self,line_ids,times,ips,delimeter=b','):
+        """Parse a batch of requests sent by a `RequestDispatcher`
+
+        :param line_ids: Array of the integer line ids of the requests
+        :param times: Array of the integer epoch seconds of the requests
+        :param ips: ip addresses of the requests joined by `delimeter`
+        :param delimeter: Delimeter the requests were split by (default = b',')
+        """
+
+        # with bytes lines, ip addresses are decoded for new users only
+        decode_ip = isinstance(delimeter,bytes) and not isinstance(delimeter,str)
+
+        inactivity_period = self.inactivity_period
+        validate_ip = self.validate_ip
+        active_users = self.active_users
+        current_time = self.current_time
+
+        last_ip = None
+        last_user = None
+
+        for lid, dtime, uip in zip(line_ids,times,ips.split(delimeter)):
+
+            # the requests are in chronological order, check for terminated
+            # sessions when the time changes
+            if dtime != current_time:
+                current_time = self.current_time = dtime
+                if active_users:
+                    oldest = active_users[next(iter(active_users))]
+                    if dtime - oldest.latest_time > inactivity_period:
+                        self._detect_terminated_sessions()
+                        last_ip = None
+
+            # same user as the previous request
+            if uip == last_ip:
+                last_user.update(current_time)
+                continue
+
+            # Check if user is active, and store or update as necessary
+            u = active_users.get(uip)
+            if u is None:
+                try:
+                    u = User(lid,uip.decode('utf-8') if decode_ip else uip,
+                             current_time,validate_ip)
+                except ValueError:
+                    self._skip_line(lid)
+                    continue
+                active_users[uip] = u
+            else:
+                u.update(current_time)
+
+                # move the user to the back of the expiry order
+                active_users[uip] = active_users.pop(uip)
+
+            last_ip = uip
+            last_user = u
+
+    def _write_session_info(self,sessions):
+        """Write session information for list of Users to `output`, tagged with
+        the log line id and end time of the session.
+        """
+
+        self.output.write(''.join([ str(user.lid) + ',' +
+                                    str(user.latest_time) + ',' +
+                                    user.session_info() for user in sessions ]))
+
+
+def sort_shard_sessions(path,ticks,inactivity_period):
+    """Sort the sessions written by a `ShardSessionParser` to file `path` into
+    their output order.
+
+    A session is output at the first time in `ticks` (the sorted times at which
+    the clock changed) beyond its inactivity period, or at the end of the log.
+    Sessions output at the same time are ordered by line id. The file is
+    rewritten with lines::
+
+        >>> tick_index,line_id,ip,start_datetime,end_datetime,session_length,num_docs
+
+    :param path: File path with sessions written by a `ShardSessionParser`
+    :param ticks: Sorted array of integer times at which the clock changed
+    :param inactivity_period: Integer number of seconds beyond which a
+                                a session is terminated
+    """
+
+    sessions = []
+    with open(path,'r') as f:
+        for line in f:
+            line_id, end_time, info = line.split(',',2)
+            tick = bisect_right(ticks,int(end_time) + inactivity_period)
+            sessions.append((tick,int(line_id),info))
+
+    sessions.sort()
+
+    with open(path,'w',BUFFER_SIZE) as f:
+        f.write(''.join([ str(tick) + ',' + str(line_id) + ',' + info
+                          for tick, line_id, info in sessions ]))
+
+def merge_shard_sessions(paths,output):
+    """Merge the sorted session files at `paths` (see `sort_shard_sessions`),
+    and write the session info to `output`.
+    """
+
+    def read_sessions(f):
+        for line in f:
+            tick, line_id, info = line.split(',',2)
+            yield int(tick), int(line_id), info
+
+    files = [ open(path,'r',BUFFER_SIZE) for path in paths ]
+    try:
+        for tick, line_id, info in heapq.merge(*[ read_sessions(f) for f in files ]):
+            output.write(info)
+    finally:
+        for f in files:
+            f.close()
+
+def _parse_shard(queue,path,inactivity_period):
+    """Parse the batches of one shard from `queue` with a `ShardSessionParser`,
+    until None is received. The sessions are then sorted (see
+    `sort_shard_sessions`) with the ticks received next.
+    """
+
+    with open(path,'w',BUFFER_SIZE) as output:
+
+        sp = ShardSessionParser(output,inactivity_period=inactivity_period)
+        for batch in iter(queue.get,None):
+            sp.parse_batch(*batch)
+        sp.terminate_remaining_sessions()
+
+    sort_shard_sessions(path,queue.get(),inactivity_period)
+
+def _put(queue,worker,item):
+    """Put `item` on `queue`, unless `worker` reading the queue has exited"""
+
+    while True:
+        try:
+            queue.put(item,True,1)
+            return
+        except Full:
+            if not worker.is_alive():
+                raise RuntimeError('A worker process exited unexpectedly.')
+
+def parse_log(log_path,output,inactivity_period=2,header=1,processes=None):
+    """Parse SEC EDGAR log file `log_path` in parallel, and write the session
+    info to `output` in the same order as `SessionParser`.
+
+    The log is read and split into shards of ip addresses by a
+    `RequestDispatcher` in this process, and each of `processes` worker
+    processes parses the requests of one shard.
+
+    :param log_path: File path with csv log data
+    :param output: File object to write session info to
+    :param inactivity_period: Integer number of seconds beyond which a
+                                a session is terminated (default = 2).
+    :param header: Number of header lines to skip (default = 1)
+    :param processes: Number of worker processes (default = number of cpus)
+    """
+
+    if processes is None:
+        processes = cpu_count()
+
+    tmp_dir = tempfile.mkdtemp()
+    paths = [ os.path.join(tmp_dir,'shard'+str(i)+'.txt')
+              for i in range(processes) ]
+    queues = [ Queue(QUEUE_SIZE) for i in range(processes) ]
+    workers = [ Process(target=_parse_shard,args=(queue,path,inactivity_period))
+                for queue, path in zip(queues,paths) ]
+    try:
+        for worker in workers:
+            worker.start()
+
+        def send(shard,batch):
+            _put(queues[shard],workers[shard],batch)
+
+        rd = RequestDispatcher(processes,send)
+        with open(log_path,'rb',BUFFER_SIZE) as f:
+
+            # skip header lines
+            for i in range(header):
+                f.readline()
+
+            rd.dispatch(read_lines(f))
+
+        # end the shards, and pass on the ticks to sort their sessions
+        for shard in range(processes):
+            send(shard,None)
+            send(shard,rd.ticks)
+
+        for worker in workers:
+            worker.join()
+        if any([ worker.exitcode != 0 for worker in workers ]):
+            raise RuntimeError('A worker process failed.')
+
+        merge_shard_sessions(paths,output)
+
+    finally:
+        # don't wait at exit to flush batches that a failed worker won't read
+        for queue, worker in zip(queues,workers):
+            queue.cancel_join_thread()
+            if worker.is_alive():
+                worker.terminate()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description=
+                                     'Parse SEC EDGAR log into Sessions, in parallel.')
+
+    parser.add_argument('log_file', metavar='log*.csv',
+                        help='EDGAR weblog data file (csv)')
+    parser.add_argument('inactivity_period', metavar='inactivity_period',
+                        type=argparse.FileType('r'),
+                        help='text file storing integer inactivity period')
+    parser.add_argument('output_file', metavar='output',
+                        type=argparse.FileType('a',BUFFER_SIZE),
+                        help='output text file with session information',
+                        default=sys.stdout)
+    parser.add_argument("-d", "--header", type=int,
+                    help="number of header lines to skip at start of log file",default=1 )
+    parser.add_argument("-j", "--processes", type=int,
+                    help="number of worker processes (default = number of cpus)" )
+
+    args = parser.parse_args()
+
+    if args.processes is not None and args.processes < 1:
+        raise ValueError("processes ('-j') must be a positive integer")
+
+    # Store inactivity period
+    with args.inactivity_period as f:
+        inactivity_period = read_inactivity_period(f)
+
+    with args.output_file as output:
+        parse_log(args.log_file,output,inactivity_period=inactivity_period,
+                  header=args.header,processes=args.processes)